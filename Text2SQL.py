@@ -1,17 +1,218 @@
+import asyncio
+import contextlib
 import json
+import logging
 import re
-import pandas as pd
+import functools
+from collections import OrderedDict
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.runnables import RunnablePassthrough
 from langchain_community.utilities import SQLDatabase
 from langchain_core.output_parsers import StrOutputParser
 from sqlalchemy import create_engine, text
+import sqlglot
+from sqlglot import exp
+from sqlglot.errors import SqlglotError
+from sqlglot.optimizer.scope import traverse_scope
 import os
 import sys
-from typing import Dict, List, Tuple, Optional
+import threading
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Tuple, Optional
 from dataclasses import dataclass
 
+if TYPE_CHECKING:
+    import pandas as pd  # Imported lazily in execute_query to keep startup fast
+
+try:
+    import connectorx as cx  # Optional: fast SELECT -> DataFrame path
+except ImportError:
+    cx = None
+
+# Precompiled patterns for the regex-based SQL parsers (queries are lowercased before matching)
+_TABLE_RE = re.compile(r'\b(?P<kw>from|join|into|update)\s+(?P<tbl>[a-zA-Z_][a-zA-Z0-9_]*)')
+_SELECT_RE = re.compile(r'select\s+(.*?)\s+from', re.DOTALL)
+_DISTINCT_RE = re.compile(r'^(distinct\s+)')
+_FENCE_RE = re.compile(r'^```(?:sql)?\s*|\s*```$', re.IGNORECASE)
+_USERS_RE = re.compile(r'\busers\b', re.IGNORECASE)
+_STRING_LITERAL_RE = re.compile(r"'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.|\"\")*\"")
+
+# Stateless output parser shared by all chains
+_STR_PARSER = StrOutputParser()
+
+# Threads that asked for quiet parsing (see _quiet_sqlglot)
+_sqlglot_quiet = threading.local()
+
+class _SqlglotQuietFilter(logging.Filter):
+    """Drops sqlglot warnings raised on threads inside _quiet_sqlglot"""
+    
+    def filter(self, record: logging.LogRecord) -> bool:
+        return not getattr(_sqlglot_quiet, "active", False)
+
+logging.getLogger("sqlglot").addFilter(_SqlglotQuietFilter())
+
+@contextlib.contextmanager
+def _quiet_sqlglot(quiet: bool):
+    """Silence sqlglot logging on the current thread only, so batch workers stay quiet"""
+    previous = getattr(_sqlglot_quiet, "active", False)
+    _sqlglot_quiet.active = previous or quiet
+    try:
+        yield
+    finally:
+        _sqlglot_quiet.active = previous
+
+async def _ainput(prompt: str) -> str:
+    """Read a line from stdin without blocking the event loop"""
+    # A daemon thread (not asyncio.to_thread) so a pending input() cannot block exit after Ctrl+C
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+    
+    def _set(callback, value):
+        if not future.done():
+            callback(value)
+    
+    def _read():
+        try:
+            line = input(prompt)
+        except BaseException as e:
+            loop.call_soon_threadsafe(_set, future.set_exception, e)
+        else:
+            loop.call_soon_threadsafe(_set, future.set_result, line)
+    
+    threading.Thread(target=_read, daemon=True).start()
+    return await future
+
+class _ColumnResolver:
+    """Resolves columns to real table names using the database schema"""
+    
+    def __init__(self, get_columns: Optional[Callable[[str], List[str]]]):
+        self._get_columns = get_columns
+        self._columns: Dict[str, set] = {}
+    
+    def _columns_of(self, table_name: str) -> set:
+        """Lowercased columns of a table (empty if unknown)"""
+        if table_name not in self._columns:
+            columns = self._get_columns(table_name) if self._get_columns else []
+            self._columns[table_name] = {c.lower() for c in columns}
+        return self._columns[table_name]
+    
+    def resolve(self, column: exp.Column, sources: Dict[str, str], local_tables: List[str], select_aliases: set) -> List[str]:
+        """Tables a column may belong to; derived-table columns resolve to none"""
+        if column.table:
+            table_name = sources.get(column.table.lower())
+            return [table_name] if table_name else []
+        
+        name = column.name.lower()
+        if name in select_aliases:
+            return []
+        matches = [t for t in local_tables if name in self._columns_of(t)]
+        if not matches:
+            # Correlated reference to a table of an enclosing query
+            matches = [t for t in dict.fromkeys(sources.values()) if name in self._columns_of(t)]
+        if matches:
+            return matches
+        # Not found in any known table: it can only come from a table whose schema is unknown
+        return [t for t in local_tables if not self._columns_of(t)]
+
+def parse_statements(query: str, verbose: bool = True) -> Optional[List[exp.Expression]]:
+    """Parse SQL into sqlglot statements once per check (None if sqlglot cannot parse it)"""
+    try:
+        return [stmt for stmt in sqlglot.parse(query, read="mysql") if stmt is not None]
+    except SqlglotError as e:
+        if verbose:
+            print(f"sqlglot parsing failed: {e}")
+        return None
+
+def parse_sql_with_ast(statements: List[exp.Expression], get_columns: Optional[Callable[[str], List[str]]] = None) -> Dict:
+    """Extract operation, tables and columns from statements returned by parse_statements"""
+    if len(statements) != 1:
+        raise ValueError("Chỉ được phép thực thi một câu truy vấn SQL duy nhất")
+    tree = statements[0]
+    
+    # Determine operation (UNION etc. are read-only queries)
+    if isinstance(tree, exp.Query):
+        operation = "SELECT"
+    elif isinstance(tree, (exp.Insert, exp.Update, exp.Delete)):
+        operation = tree.key.upper()
+    else:
+        raise ValueError(f"Không hỗ trợ câu lệnh SQL '{tree.key.upper()}'")
+    
+    # Find tables, skipping CTE names
+    cte_names = {cte.alias_or_name.lower() for cte in tree.find_all(exp.CTE)}
+    tables = []
+    for table in tree.find_all(exp.Table):
+        if table.name and table.name.lower() not in cte_names and table.name not in tables:
+            tables.append(table.name)
+    
+    # Only projected (SELECT) and updated (SET) columns are checked, as with the LLM parser
+    resolver = _ColumnResolver(get_columns)
+    columns_by_table = {}
+    
+    def add(column: exp.Column, sources: Dict[str, str], local_tables: List[str], select_aliases: set) -> None:
+        if isinstance(column.this, exp.Star):
+            return
+        for table_name in resolver.resolve(column, sources, local_tables, select_aliases):
+            columns = columns_by_table.setdefault(table_name, [])
+            if column.name not in columns:
+                columns.append(column.name)
+    
+    if isinstance(tree, exp.Update):
+        # Tables of the UPDATE itself, not of subqueries in SET/WHERE
+        sources = {
+            table.alias_or_name.lower(): table.name
+            for table in tree.find_all(exp.Table) if table.find_ancestor(exp.Select) is None
+        }
+        for assignment in tree.expressions:
+            if isinstance(assignment.this, exp.Column):
+                add(assignment.this, sources, list(dict.fromkeys(sources.values())), set())
+    
+    # Projections of every SELECT scope (top level, subqueries, CTEs, UNION branches)
+    for scope in traverse_scope(tree):
+        select = scope.expression
+        if not isinstance(select, exp.Select):
+            continue
+        # Table aliases visible in this scope, inner scopes shadowing outer ones
+        sources = {}
+        chain = []
+        current = scope
+        while current is not None:
+            chain.append(current)
+            current = current.parent
+        for visible in reversed(chain):
+            for alias, source in visible.sources.items():
+                if isinstance(source, exp.Table):
+                    sources[alias.lower()] = source.name
+                else:
+                    sources.pop(alias.lower(), None)
+        local_tables = list(dict.fromkeys(
+            source.name for source in scope.sources.values() if isinstance(source, exp.Table)
+        ))
+        select_aliases = {projection.alias.lower() for projection in select.expressions if projection.alias}
+        for projection in select.expressions:
+            for column in projection.find_all(exp.Column):
+                # Columns of scalar subqueries are handled in their own scope
+                if column.find_ancestor(exp.Select) is select:
+                    add(column, sources, local_tables, select_aliases)
+    
+    return {
+        "operation": operation,
+        "tables": tables,
+        "columns_by_table": columns_by_table
+    }
+
+def _references_users_table(query: str, statements: Optional[List[exp.Expression]]) -> bool:
+    """Check whether a query reads or writes the Users table"""
+    if not _USERS_RE.search(query):
+        return False
+    if not statements or not all(isinstance(stmt, (exp.Query, exp.Insert, exp.Update, exp.Delete)) for stmt in statements):
+        # Not reliably parsed: only ignore mentions inside string literals
+        return bool(_USERS_RE.search(_STRING_LITERAL_RE.sub("''", query)))
+    return any(
+        table.name.lower() == 'users'
+        for stmt in statements
+        for table in stmt.find_all(exp.Table)
+    )
+
 @dataclass
 class DatabaseConfig:
     """Database configuration"""
@@ -20,10 +221,18 @@ class DatabaseConfig:
     user: str = "root"
     password: str = "123"
     database: str = "SchoolDB"
+    pool_size: int = 5
+    max_overflow: int = 10
+    pool_recycle: int = 3600  # seconds, below MySQL's default wait_timeout
+    use_connectorx: bool = False  # read every SELECT with connectorx (bypasses the pool)
     
     @property
     def uri(self) -> str:
         return f"mysql+pymysql://{self.user}:{self.password}@{self.host}:{self.port}/{self.database}"
+    
+    @property
+    def connectorx_uri(self) -> str:
+        return f"mysql://{self.user}:{self.password}@{self.host}:{self.port}/{self.database}"
 
 @dataclass
 class UserInfo:
@@ -31,75 +240,160 @@ class UserInfo:
     user_id: str
     role: str  # 'student' or 'teacher'
     role_id: int
+
+@dataclass
+class QueryResult:
+    """Result of executing a query: rows for SELECT, affected row count for writes, or an error"""
+    rows: Optional["pd.DataFrame"] = None
+    affected: int = 0
+    error: Optional[str] = None
     
 class DatabaseManager:
     """Manages database connections and operations"""
     
+    _CHUNK_SIZE = 10_000
+    
     def __init__(self, config: DatabaseConfig):
         self.config = config
         self.engine = None
         self.db = None
+        self._schema_cache: Optional[str] = None
+        # Lowercase table name -> column names, loaded once from information_schema
+        self._columns_cache: Optional[Dict[str, List[str]]] = None
+        # Persistent autocommit connection for read-only metadata lookups
+        self._conn = None
+        self._conn_lock = threading.Lock()
         self._connect()
     
     def _connect(self):
         """Establish database connection"""
         try:
-            self.engine = create_engine(self.config.uri)
-            self.db = SQLDatabase.from_uri(self.config.uri)
+            self.engine = create_engine(
+                self.config.uri,
+                pool_size=self.config.pool_size,
+                max_overflow=self.config.max_overflow,
+                pool_pre_ping=True,
+                pool_recycle=self.config.pool_recycle
+            )
+            # Share the pooled engine instead of letting SQLDatabase create its own
+            self.db = SQLDatabase(self.engine)
             print("Kết nối cơ sở dữ liệu thành công!")
         except Exception as e:
             print(f"Lỗi kết nối cơ sở dữ liệu: {e}")
             sys.exit(1)
     
-    def execute_query(self, query: str) -> pd.DataFrame:
+    def _get_connection(self):
+        """Get the persistent read-only connection, opening it on first use (caller holds _conn_lock)"""
+        if self._conn is None or self._conn.closed:
+            self._conn = self.engine.connect().execution_options(isolation_level="AUTOCOMMIT")
+        return self._conn
+    
+    def close(self) -> None:
+        """Close the persistent connection and release pooled connections"""
+        with self._conn_lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+        self.engine.dispose()
+    
+    def execute_query(self, query: str, partition_on: Optional[str] = None, partition_num: int = 4, verbose: bool = True) -> QueryResult:
         """Execute SQL query and return results"""
         try:
+            query_lower = query.lower().strip()
+            # Opt-in connectorx path for analytical reads; partition_on (a numeric column) splits
+            # the read into parallel queries. Everything else uses the pooled pandas path.
+            use_connectorx = partition_on is not None or self.config.use_connectorx
+            if query_lower.startswith('select') and use_connectorx and cx is not None:
+                try:
+                    return QueryResult(rows=self._read_sql_connectorx(query, partition_on, partition_num))
+                except Exception as e:
+                    if verbose:
+                        print(f"connectorx không đọc được truy vấn, chuyển sang pandas: {e}")
+            
             with self.engine.connect() as connection:
-                with connection.begin():
-                    query_lower = query.lower().strip()
-                    if query_lower.startswith('select'):
-                        result = pd.read_sql(query, connection)
-                        return result
-                    else:
+                if query_lower.startswith('select'):
+                    import pandas as pd
+                    # Server-side cursor: rows are fetched in chunks instead of buffered all at once
+                    streaming = connection.execution_options(stream_results=True)
+                    chunks = list(pd.read_sql(query, streaming, chunksize=self._CHUNK_SIZE))
+                    rows = pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame()
+                    return QueryResult(rows=rows)
+                else:
+                    # Only writes need an explicit transaction
+                    with connection.begin():
                         result = connection.execute(text(query))
-                        print(f"Đã thực thi {query_lower.split()[0].upper()}: {result.rowcount} hàng bị ảnh hưởng.")
-                        return pd.DataFrame({"result": ["Thực thi thành công."]})
+                    return QueryResult(affected=result.rowcount)
         except Exception as e:
-            print(f"Lỗi khi thực thi truy vấn: {e}")
-            return pd.DataFrame({"error": [str(e)]})
+            if verbose:
+                print(f"Lỗi khi thực thi truy vấn: {e}")
+            return QueryResult(error=str(e))
+    
+    def _read_sql_connectorx(self, query: str, partition_on: Optional[str], partition_num: int) -> "pd.DataFrame":
+        """Read a SELECT straight into a DataFrame with connectorx"""
+        # connectorx wraps the query in a subquery when partitioning, so drop the trailing semicolon
+        query = query.strip().rstrip(';')
+        if partition_on:
+            return cx.read_sql(
+                self.config.connectorx_uri, query, return_type="pandas",
+                partition_on=partition_on, partition_num=partition_num
+            )
+        return cx.read_sql(self.config.connectorx_uri, query, return_type="pandas")
     
     def get_schema(self) -> str:
-        """Get database schema information"""
-        return self.db.get_table_info()
+        """Get database schema information (cached after the first call)"""
+        if self._schema_cache is None:
+            self._schema_cache = self.db.get_table_info()
+        return self._schema_cache
+    
+    def invalidate_schema(self) -> None:
+        """Drop the cached schema so the next get_schema call reloads it (e.g. after DDL changes)"""
+        self._schema_cache = None
+        self._columns_cache = None
     
-    def get_table_columns(self, table_name: str) -> List[str]:
+    def get_table_columns(self, table_name: str, verbose: bool = True) -> List[str]:
         """Get all columns of a table"""
         try:
-            with self.engine.connect() as connection:
-                query = f"SHOW COLUMNS FROM {table_name}"
-                result = pd.read_sql(query, connection)
-                return result['Field'].tolist()
+            with self._conn_lock:
+                if self._columns_cache is None:
+                    self._columns_cache = self._load_columns()
+                return list(self._columns_cache.get(table_name.lower(), []))
         except Exception as e:
-            print(f"Lỗi khi lấy cột của bảng {table_name}: {e}")
+            if verbose:
+                print(f"Lỗi khi lấy cột của bảng {table_name}: {e}")
             return []
     
+    def _load_columns(self) -> Dict[str, List[str]]:
+        """Load the columns of every table in one query (caller holds _conn_lock)"""
+        connection = self._get_connection()
+        rows = connection.execute(
+            text(
+                "SELECT TABLE_NAME, COLUMN_NAME FROM information_schema.COLUMNS "
+                "WHERE TABLE_SCHEMA = :db ORDER BY TABLE_NAME, ORDINAL_POSITION"
+            ),
+            {"db": self.config.database}
+        ).all()
+        columns: Dict[str, List[str]] = {}
+        for table_name, column_name in rows:
+            columns.setdefault(table_name.lower(), []).append(column_name)
+        return columns
+    
     def get_user_info(self, user_id: str) -> Optional[UserInfo]:
         """Determine user role and get role_id from user_id"""
         try:
-            with self.engine.connect() as connection:
-                # Check if user is a student
-                student_query = "SELECT StudentID FROM Students WHERE UserID = %s"
-                student_result = pd.read_sql(student_query, connection, params=(user_id,))
-                
-                if not student_result.empty:
-                    return UserInfo(user_id, "student", student_result.iloc[0, 0])
+            with self._conn_lock:
+                connection = self._get_connection()
+                # Look up student and teacher roles in a single round-trip
+                role_query = text(
+                    "SELECT 'student' AS role, StudentID AS role_id FROM Students WHERE UserID = :uid "
+                    "UNION ALL "
+                    "SELECT 'teacher', TeacherID FROM Teachers WHERE UserID = :uid "
+                    # Students take precedence, as in the original two-query lookup
+                    "ORDER BY role = 'teacher'"
+                )
+                row = connection.execute(role_query, {"uid": user_id}).first()
                 
-                # Check if user is a teacher
-                teacher_query = "SELECT TeacherID FROM Teachers WHERE UserID = %s"
-                teacher_result = pd.read_sql(teacher_query, connection, params=(user_id,))
-                
-                if not teacher_result.empty:
-                    return UserInfo(user_id, "teacher", teacher_result.iloc[0, 0])
+                if row is not None:
+                    return UserInfo(user_id, row[0], int(row[1]))
                 
                 return None
         except Exception as e:
@@ -109,8 +403,13 @@ class DatabaseManager:
 class SQLParserLLM:
     """LLM-based SQL parser for better accuracy"""
     
+    _MAX_CACHE_SIZE = 256
+    
     def __init__(self, llm):
         self.llm = llm
+        # LRU cache of successful LLM parses keyed by exact query text
+        self._parse_cache: "OrderedDict[str, Dict]" = OrderedDict()
+        self._cache_lock = threading.Lock()
         self.parser_prompt = ChatPromptTemplate.from_template("""
 Bạn là một chuyên gia phân tích SQL. Hãy phân tích câu truy vấn SQL sau và trả về thông tin dưới dạng JSON với cấu trúc:
 
@@ -133,40 +432,46 @@ QUY TẮC:
 
 SQL Query: {query}
 """)
+        # Gemini JSON mode: the response is raw JSON without markdown fences
+        self.json_llm = llm.bind(generation_config={"response_mime_type": "application/json"})
+        self.parser_chain = self.parser_prompt | self.json_llm | _STR_PARSER
     
-    def parse_sql_with_llm(self, query: str) -> Dict:
+    def parse_sql_with_llm(self, query: str, query_lower: Optional[str] = None, verbose: bool = True) -> Dict:
         """Parse SQL using LLM for better accuracy"""
+        # Keyed on the exact text: collapsing whitespace would merge queries whose
+        # newlines end -- or # comments and so differ in meaning
+        key = query
+        with self._cache_lock:
+            cached = self._parse_cache.get(key)
+            if cached is not None:
+                self._parse_cache.move_to_end(key)
+                return cached
+        
         try:
-            chain = self.parser_prompt | self.llm | StrOutputParser()
-            result = chain.invoke({"query": query})
-            
-            # Clean up markdown formatting if present
-            if result.startswith('```json'):
-                result = result[7:]
-            elif result.startswith('```'):
-                result = result[3:]
-            if result.endswith('```'):
-                result = result[:-3]
-            
-            result = result.strip()
-            
-            # Parse JSON
-            parsed_result = json.loads(result)
-            
-            # Validate structure
-            if not all(key in parsed_result for key in ["operation", "tables", "columns_by_table"]):
-                raise ValueError("Missing required keys in parsed result")
-            
-            return parsed_result
-            
-        except (json.JSONDecodeError, Exception) as e:
-            print(f"LLM parsing failed, falling back to regex: {e}")
-            # Fallback to regex parsing
-            return self._fallback_regex_parse(query)
+            result = self.parser_chain.invoke({"query": query})
+        except Exception as e:
+            if verbose:
+                print(f"LLM parsing failed, falling back to regex: {e}")
+            # Fallback to regex parsing only when the LLM call itself fails
+            return self._fallback_regex_parse(query, query_lower)
+        
+        # JSON mode returns raw JSON, so malformed output is an error rather than a fallback
+        parsed_result = json.loads(result)
+        
+        # Validate structure
+        if not all(k in parsed_result for k in ["operation", "tables", "columns_by_table"]):
+            raise ValueError("Missing required keys in parsed result")
+        
+        with self._cache_lock:
+            self._parse_cache[key] = parsed_result
+            if len(self._parse_cache) > self._MAX_CACHE_SIZE:
+                self._parse_cache.popitem(last=False)
+        
+        return parsed_result
     
-    def _fallback_regex_parse(self, query: str) -> Dict:
+    def _fallback_regex_parse(self, query: str, query_lower: Optional[str] = None) -> Dict:
         """Fallback regex parsing method"""
-        query_lower = query.lower().strip()
+        query_lower = (query_lower if query_lower is not None else query.lower()).strip()
         
         # Determine operation
         operation = None
@@ -175,27 +480,14 @@ SQL Query: {query}
                 operation = op
                 break
         
-        # Find tables
-        tables = []
-        table_patterns = [
-            r'\bfrom\s+([a-zA-Z_][a-zA-Z0-9_]*)',
-            r'\bjoin\s+([a-zA-Z_][a-zA-Z0-9_]*)',
-            r'\binto\s+([a-zA-Z_][a-zA-Z0-9_]*)',
-            r'\bupdate\s+([a-zA-Z_][a-zA-Z0-9_]*)'
-        ]
-        
-        for pattern in table_patterns:
-            matches = re.findall(pattern, query_lower, re.IGNORECASE)
-            tables.extend(matches)
-        
-        # Remove duplicates and capitalize
-        tables = list(set([t.capitalize() for t in tables]))
+        # Find tables in a single pass, removing duplicates and capitalizing
+        tables = list({m.group('tbl').capitalize() for m in _TABLE_RE.finditer(query_lower)})
         
         # Find columns (basic regex approach)
         columns_by_table = {}
         
         if operation == "SELECT":
-            select_match = re.search(r'select\s+(.*?)\s+from', query_lower, re.IGNORECASE | re.DOTALL)
+            select_match = _SELECT_RE.search(query_lower)
             if select_match:
                 select_part = select_match.group(1)
                 columns = []
@@ -205,7 +497,7 @@ SQL Query: {query}
                     if col == '*':
                         continue
                     # Remove DISTINCT, functions
-                    col = re.sub(r'^(distinct\s+)', '', col, flags=re.IGNORECASE)
+                    col = _DISTINCT_RE.sub('', col)
                     # Handle table.column format
                     if '.' in col:
                         table_part, col_part = col.split('.', 1)
@@ -228,95 +520,101 @@ SQL Query: {query}
         }
 
 class PermissionManager:
-    """Manages user permissions with enhanced LLM-based parsing"""
+    """Manages user permissions with AST-based SQL parsing"""
     
-    def __init__(self, config_file: str = "permissions2.json", llm=None):
+    _MAX_CACHE_SIZE = 256
+    
+    def __init__(self, config_file: str = "permissions2.json", llm=None, use_llm_fallback: bool = True):
         self.permissions = self._load_permissions(config_file)
-        self.sql_parser = SQLParserLLM(llm) if llm else None
+        # LLM parsing is only used for queries sqlglot cannot parse
+        self.sql_parser = SQLParserLLM(llm) if llm and use_llm_fallback else None
+        # LRU set of (exact query text, role) pairs already granted
+        self._allowed_cache: "OrderedDict[Tuple[str, str], bool]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+        # Lowercased allowed columns: role -> table key -> set of column names
+        self._lower_allowed = {
+            role: {
+                table: {c.lower() for c in table_config.get("allowed_columns", [])}
+                for table, table_config in role_config.get("table_permissions", {}).items()
+            }
+            for role, role_config in self.permissions["roles"].items()
+        }
         
     def _load_permissions(self, config_file: str) -> Dict:
         """Load permissions configuration"""
         try:
             with open(config_file, 'r', encoding='utf-8') as file:
-                return json.load(file)
+                permissions = json.load(file)
         except Exception as e:
             print(f"Lỗi khi đọc tệp cấu hình quyền: {e}")
             return {"roles": {}}
+        
+        # Case-insensitive table lookup: lowercase name -> configured table key
+        for role_config in permissions.get("roles", {}).values():
+            role_config["_lower_index"] = {t.lower(): t for t in role_config.get("table_permissions", {})}
+        return permissions
     
-    def parse_sql_query(self, query: str) -> Dict:
-        """Parse SQL query using LLM or fallback to regex"""
-        if self.sql_parser:
-            return self.sql_parser.parse_sql_with_llm(query)
-        else:
-            return self.sql_parser._fallback_regex_parse(query) if self.sql_parser else self._basic_regex_parse(query)
+    def clear_cache(self) -> None:
+        """Forget granted checks (they depend on the schema used to resolve columns)"""
+        with self._cache_lock:
+            self._allowed_cache.clear()
     
-    def _basic_regex_parse(self, query: str) -> Dict:
-        """Basic regex parsing when LLM is not available"""
-        query_lower = query.lower().strip()
-        
-        # Determine operation
-        operation = None
-        for op in ["SELECT", "INSERT", "UPDATE", "DELETE"]:
-            if query_lower.startswith(op.lower()):
-                operation = op
-                break
+    def parse_sql_query(self, query: str, statements: Optional[List[exp.Expression]], query_lower: Optional[str] = None, db_manager: Optional[DatabaseManager] = None, verbose: bool = True) -> Dict:
+        """Use the sqlglot statements, falling back to the LLM parser if sqlglot could not parse the query"""
+        if statements is not None:
+            get_columns = functools.partial(db_manager.get_table_columns, verbose=verbose) if db_manager else None
+            return parse_sql_with_ast(statements, get_columns)
         
-        # Find tables
-        tables = []
-        table_patterns = [
-            r'\bfrom\s+([a-zA-Z_][a-zA-Z0-9_]*)',
-            r'\bjoin\s+([a-zA-Z_][a-zA-Z0-9_]*)',
-            r'\binto\s+([a-zA-Z_][a-zA-Z0-9_]*)',
-            r'\bupdate\s+([a-zA-Z_][a-zA-Z0-9_]*)'
-        ]
-        
-        for pattern in table_patterns:
-            matches = re.findall(pattern, query_lower, re.IGNORECASE)
-            tables.extend(matches)
-        
-        # Remove duplicates and capitalize
-        tables = list(set([t.capitalize() for t in tables]))
-        
-        return {
-            "operation": operation,
-            "tables": tables,
-            "columns_by_table": {}
-        }
+        if self.sql_parser:
+            return self.sql_parser.parse_sql_with_llm(query, query_lower, verbose)
+        # Without the LLM there is no parser that can check columns, so refuse the query
+        raise ValueError("Không phân tích được truy vấn SQL, truy vấn bị từ chối")
     
-    def check_permissions(self, query: str, user_role: str, db_manager: DatabaseManager) -> bool:
+    def check_permissions(self, query: str, user_role: str, db_manager: DatabaseManager, verbose: bool = True) -> bool:
         """Check if user has permission to execute the query"""
         if user_role not in self.permissions["roles"]:
             raise ValueError(f"Vai trò '{user_role}' không được định nghĩa trong cấu hình.")
 
+        query_lower = query.lower()
+        # Exact text, never whitespace-normalized: newlines end SQL comments
+        cache_key = (query, user_role)
+        with self._cache_lock:
+            if cache_key in self._allowed_cache:
+                self._allowed_cache.move_to_end(cache_key)
+                return True
+
         role_config = self.permissions["roles"][user_role]
         table_permissions = role_config.get("table_permissions", {})
 
-        # Check for Users table access
-        if 'users' in query.lower():
-            raise ValueError("Truy vấn không được phép truy cập bảng 'Users'")
+        with _quiet_sqlglot(not verbose):
+            # Parse once; the tree is shared by the Users check and column extraction
+            statements = parse_statements(query, verbose)
 
-        # Parse query with enhanced method
-        try:
-            parsed_info = self.parse_sql_query(query)
-            operation = parsed_info.get("operation")
-            tables = parsed_info.get("tables", [])
-            columns_by_table = parsed_info.get("columns_by_table", {})
-        except Exception as e:
-            print(f"Warning: Failed to parse query with enhanced method: {e}")
-            # Use basic fallback
-            parsed_info = self._basic_regex_parse(query)
-            operation = parsed_info.get("operation")
-            tables = parsed_info.get("tables", [])
-            columns_by_table = {}
+            # Check for Users table access
+            if _references_users_table(query, statements):
+                raise ValueError("Truy vấn không được phép truy cập bảng 'Users'")
+
+            # Parse query with enhanced method
+            try:
+                parsed_info = self.parse_sql_query(query, statements, query_lower, db_manager, verbose)
+                operation = parsed_info.get("operation")
+                tables = parsed_info.get("tables", [])
+                columns_by_table = parsed_info.get("columns_by_table", {})
+            except ValueError:
+                raise
+            except Exception as e:
+                # Never fall back to a parser that skips column checks
+                raise ValueError(f"Không phân tích được truy vấn SQL: {e}") from e
 
         if not operation:
             raise ValueError("Không xác định được thao tác SQL")
 
-        print(f"Debug - Parsed: Operation={operation}, Tables={tables}, Columns={columns_by_table}")
+        if verbose:
+            print(f"Debug - Parsed: Operation={operation}, Tables={tables}, Columns={columns_by_table}")
 
         # Check permissions for each table
         for table in tables:
-            table_key = next((t for t in table_permissions if t.lower() == table.lower()), None)
+            table_key = role_config["_lower_index"].get(table.lower())
             
             if table_key is None and "*" not in table_permissions:
                 raise ValueError(f"Vai trò '{user_role}' không được phép truy vấn bảng '{table}'")
@@ -337,25 +635,32 @@ class PermissionManager:
                 
                 # If LLM parsing worked and we have specific columns
                 if columns_for_table:
+                    allowed_columns_lower = self._lower_allowed[user_role][table_key or "*"]
                     for col in columns_for_table:
                         # Skip wildcard and function results
                         if col == '*' or '(' in col:
                             continue
-                        if not any(col.lower() == allowed_col.lower() for allowed_col in allowed_columns):
+                        if col.lower() not in allowed_columns_lower:
                             raise ValueError(f"Vai trò '{user_role}' không được phép truy vấn cột '{col}' trong bảng '{table}'")
                 # If no specific columns found but we have SELECT *, check if * is allowed
                 elif operation == "SELECT" and not columns_for_table:
                     # This might be SELECT * case, we'll allow it if the role has general access
                     pass
 
+        with self._cache_lock:
+            self._allowed_cache[cache_key] = True
+            if len(self._allowed_cache) > self._MAX_CACHE_SIZE:
+                self._allowed_cache.popitem(last=False)
+
         return True
 
 class SQLTemplateManager:
     """Manages SQL query templates for different roles"""
     
     @staticmethod
-    def create_template(user_role: str, role_id: int) -> str:
-        """Create role-specific template"""
+    @functools.lru_cache(maxsize=128)
+    def create_template(user_role: str) -> str:
+        """Create role-specific template ({role_id} is filled in as a prompt variable)"""
         
         base_template = """
 Dựa trên schema bảng dưới đây, viết một câu truy vấn SQL thuần túy để trả về câu trả lời cho câu hỏi.
@@ -366,7 +671,7 @@ Không được truy vấn bảng Users hoặc cột UserID.
 """
 
         if user_role.lower() == "student":
-            role_specific = f"""
+            role_specific = """
 BẠN LÀ SINH VIÊN với StudentID = {role_id}.
 
 QUY TẮC BẮT BUỘC:
@@ -381,7 +686,7 @@ VÍ DỤ:
   SQL: SELECT Courses.CourseName, Courses.CourseCode, Classes.Semester, Classes.AcademicYear, Enrollments.Status FROM Enrollments JOIN Classes ON Enrollments.ClassID = Classes.ClassID JOIN Courses ON Classes.CourseID = Courses.CourseID WHERE Enrollments.StudentID = {role_id}
 """
         else:  # teacher
-            role_specific = f"""
+            role_specific = """
 BẠN LÀ GIẢNG VIÊN với TeacherID = {role_id}.
 
 QUY TẮC BẮT BUỘC:
@@ -409,55 +714,64 @@ class QueryProcessor:
             google_api_key=api_key,
             temperature=0
         )
+        # Stop tokens are constant, so bind them once for every chain
+        self._bound_llm = self.llm.bind(stop=["\nSQL Result:", "SQL Result:", "\n\n", ";"])
         self.db_manager = DatabaseManager(DatabaseConfig())
         # Pass LLM to PermissionManager for enhanced parsing
         self.permission_manager = PermissionManager(llm=self.llm)
+        # Chains keyed by role and shared by all users of that role
+        self._chain_cache: Dict[str, Any] = {}
+        for role in ("student", "teacher"):
+            self.get_chain(role)
         
-    def create_chain(self, user_info: UserInfo):
+    def create_chain(self, role: str):
         """Create SQL processing chain"""
-        template = SQLTemplateManager.create_template(user_info.role, user_info.role_id)
+        template = SQLTemplateManager.create_template(role)
         prompt = ChatPromptTemplate.from_template(template)
+        schema = self.db_manager.get_schema()
         
         chain = (
-            RunnablePassthrough.assign(schema=lambda _: self.db_manager.get_schema())
+            RunnablePassthrough.assign(schema=lambda _: schema)
             | prompt 
-            | self.llm.bind(stop=["\nSQL Result:", "SQL Result:", "\n\n", ";"])
-            | StrOutputParser()
+            | self._bound_llm
+            | _STR_PARSER
         )
         
         return chain
     
+    def get_chain(self, role: str):
+        """Get the cached SQL processing chain for a role, building it on first use"""
+        chain = self._chain_cache.get(role)
+        if chain is None:
+            chain = self.create_chain(role)
+            self._chain_cache[role] = chain
+        return chain
+    
+    def refresh_schema(self) -> None:
+        """Reload the schema and rebuild chains on next use (e.g. after DDL changes)"""
+        self.db_manager.invalidate_schema()
+        self.permission_manager.clear_cache()
+        self._chain_cache.clear()
+    
     def clean_query(self, query: str) -> str:
         """Clean and normalize SQL query"""
         if not query or not query.strip():
             return ""
             
-        cleaned = query.strip()
-        
         # Remove markdown formatting
-        if cleaned.startswith('```sql'):
-            cleaned = cleaned[6:]
-        elif cleaned.startswith('```'):
-            cleaned = cleaned[3:]
-        if cleaned.endswith('```'):
-            cleaned = cleaned[:-3]
-        
-        cleaned = cleaned.strip()
+        cleaned = _FENCE_RE.sub('', query.strip()).strip()
         
         # Add semicolon if missing
-        if not cleaned.endswith(';'):
-            cleaned += ';'
-            
-        return cleaned
+        return cleaned if cleaned.endswith(';') else cleaned + ';'
     
-    def process_question(self, question: str, user_info: UserInfo) -> None:
+    async def process_question(self, question: str, user_info: UserInfo) -> None:
         """Process a single question"""
         try:
             print(f"Câu hỏi: {question}")
             
-            # Create chain and generate SQL
-            chain = self.create_chain(user_info)
-            sql_query = chain.invoke({"question": question})
+            # Get chain and generate SQL
+            chain = self.get_chain(user_info.role)
+            sql_query = await chain.ainvoke({"question": question, "role_id": user_info.role_id})
             
             if not sql_query or not sql_query.strip():
                 print("Không tạo được truy vấn SQL cho câu hỏi.")
@@ -467,13 +781,8 @@ class QueryProcessor:
             cleaned_query = self.clean_query(sql_query)
             print(f"SQL được tạo: {cleaned_query}")
             
-            # Check permissions with enhanced LLM parsing
-            self.permission_manager.check_permissions(
-                cleaned_query, user_info.role, self.db_manager
-            )
-            
-            # Execute query
-            result = self.db_manager.execute_query(cleaned_query)
+            # Check permissions and execute query
+            result = await self._check_and_execute(cleaned_query, user_info)
             self._display_results(result)
             
         except ValueError as ve:
@@ -481,24 +790,85 @@ class QueryProcessor:
         except Exception as e:
             print(f"Lỗi khi xử lý câu hỏi: {e}")
     
-    def _display_results(self, result: pd.DataFrame) -> None:
+    async def process_questions(self, questions: List[str], user_info: UserInfo, max_concurrency: int = 8) -> None:
+        """Process a batch of questions, generating and executing SQL concurrently"""
+        if not questions:
+            return
+        
+        # Generate SQL for all questions in parallel
+        chain = self.get_chain(user_info.role)
+        sql_queries = await chain.abatch(
+            [{"question": question, "role_id": user_info.role_id} for question in questions],
+            config={"max_concurrency": max_concurrency},
+            return_exceptions=True
+        )
+        cleaned_queries = [
+            self.clean_query(sql) if isinstance(sql, str) else "" for sql in sql_queries
+        ]
+        
+        # Check permissions and execute queries with bounded concurrency
+        semaphore = asyncio.Semaphore(max_concurrency)
+        
+        async def run(cleaned_query: str):
+            if not cleaned_query:
+                return None
+            async with semaphore:
+                # Worker-thread diagnostics would interleave with the ordered output below
+                return await self._check_and_execute(cleaned_query, user_info, verbose=False)
+        
+        results = await asyncio.gather(
+            *[run(cleaned_query) for cleaned_query in cleaned_queries],
+            return_exceptions=True
+        )
+        
+        # Display in question order
+        for question, sql_query, cleaned_query, result in zip(questions, sql_queries, cleaned_queries, results):
+            print(f"Câu hỏi: {question}")
+            if isinstance(sql_query, Exception):
+                print(f"Lỗi khi xử lý câu hỏi: {sql_query}")
+            elif not cleaned_query:
+                print("Không tạo được truy vấn SQL cho câu hỏi.")
+            else:
+                print(f"SQL được tạo: {cleaned_query}")
+                if isinstance(result, ValueError):
+                    print(f"Lỗi quyền truy cập: {result}")
+                elif isinstance(result, Exception):
+                    print(f"Lỗi khi xử lý câu hỏi: {result}")
+                else:
+                    self._display_results(result)
+            print("-" * 50)
+    
+    async def _check_and_execute(self, cleaned_query: str, user_info: UserInfo, verbose: bool = True) -> QueryResult:
+        """Check permissions and execute a cleaned query off the event loop"""
+        # Permission checks may fall back to a blocking LLM call
+        await asyncio.to_thread(
+            self.permission_manager.check_permissions,
+            cleaned_query, user_info.role, self.db_manager, verbose
+        )
+        return await asyncio.to_thread(self.db_manager.execute_query, cleaned_query, verbose=verbose)
+    
+    def _display_results(self, result: QueryResult) -> None:
         """Display query results"""
-        if result.empty:
-            print("Không có dữ liệu để hiển thị.")
+        if result.error is not None:
+            print(f"Lỗi: {result.error}")
             return
-            
-        if 'error' in result.columns:
-            print(f"Lỗi: {result.iloc[0, 0]}")
+        
+        if result.rows is None:
+            print(f"Thực thi thành công: {result.affected} hàng bị ảnh hưởng.")
+            return
+        
+        if result.rows.empty:
+            print("Không có dữ liệu để hiển thị.")
             return
             
         print("\nKết quả:")
-        print(result.to_string(index=False))
+        print(result.rows.to_string(index=False))
         print()
     
-    def run_interactive_session(self, user_id: str = "4") -> None:
+    async def run_interactive_session(self, user_id: str = "4") -> None:
         """Run interactive query session"""
         # Get user information
-        user_info = self.db_manager.get_user_info(user_id)
+        user_info = await asyncio.to_thread(self.db_manager.get_user_info, user_id)
         if not user_info:
             print(f"UserID {user_id} không tồn tại trong hệ thống")
             return
@@ -509,7 +879,7 @@ class QueryProcessor:
         
         while True:
             try:
-                question = input("Nhập câu hỏi của bạn: ").strip()
+                question = (await _ainput("Nhập câu hỏi của bạn: ")).strip()
                 if question.lower() in ['thoát', 'exit', 'quit']:
                     print("Đã thoát chương trình.")
                     break
@@ -517,10 +887,10 @@ class QueryProcessor:
                 if not question:
                     continue
                 
-                self.process_question(question, user_info)
+                await self.process_question(question, user_info)
                 print("-" * 50)
                 
-            except KeyboardInterrupt:
+            except (KeyboardInterrupt, EOFError, asyncio.CancelledError):
                 print("\nĐã thoát chương trình.")
                 break
             except Exception as e:
@@ -531,7 +901,12 @@ def main():
     API_KEY = ""
     
     processor = QueryProcessor(API_KEY)
-    processor.run_interactive_session()
+    try:
+        asyncio.run(processor.run_interactive_session())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        processor.db_manager.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
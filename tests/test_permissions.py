@@ -0,0 +1,140 @@
+import logging
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from Text2SQL import PermissionManager, parse_sql_with_ast, parse_statements  # noqa: E402
+
+SCHEMA = {
+    "students": ["StudentID", "UserID", "StudentCode", "FullName", "Email"],
+    "teachers": ["TeacherID", "UserID", "FullName", "Email"],
+    "classes": ["ClassID", "CourseID", "TeacherID", "Semester"],
+    "enrollments": ["EnrollmentID", "StudentID", "ClassID", "Grade", "Status"],
+}
+
+
+class FakeDatabaseManager:
+    """Stands in for DatabaseManager.get_table_columns"""
+
+    def get_table_columns(self, table_name, verbose=True):
+        return SCHEMA.get(table_name.lower(), [])
+
+
+@pytest.fixture
+def permission_manager():
+    return PermissionManager(config_file=os.path.join(ROOT, "permissions2.json"))
+
+
+def test_join_and_where_columns_are_not_checked():
+    parsed = parse_sql_with_ast(parse_statements(
+        "SELECT Teachers.FullName FROM Teachers "
+        "JOIN Classes ON Teachers.TeacherID = Classes.TeacherID "
+        "JOIN Enrollments ON Classes.ClassID = Enrollments.ClassID "
+        "WHERE Enrollments.StudentID = 5"),
+        FakeDatabaseManager().get_table_columns,
+    )
+    assert parsed["columns_by_table"] == {"Teachers": ["FullName"]}
+    assert set(parsed["tables"]) == {"Teachers", "Classes", "Enrollments"}
+
+
+def test_unqualified_columns_resolve_against_schema():
+    parsed = parse_sql_with_ast(parse_statements(
+        "SELECT FullName, Grade FROM Students "
+        "JOIN Enrollments ON Students.StudentID = Enrollments.StudentID "
+        "WHERE Students.StudentID = 5"),
+        FakeDatabaseManager().get_table_columns,
+    )
+    assert parsed["columns_by_table"] == {"Students": ["FullName"], "Enrollments": ["Grade"]}
+
+
+def test_update_checks_set_targets_only():
+    parsed = parse_sql_with_ast(parse_statements("UPDATE Students SET Email = 'a@b.c' WHERE StudentID = 5"))
+    assert parsed["operation"] == "UPDATE"
+    assert parsed["columns_by_table"] == {"Students": ["Email"]}
+
+
+def test_derived_table_projection_is_checked():
+    parsed = parse_sql_with_ast(parse_statements(
+        "SELECT x.FullName FROM (SELECT FullName, UserID FROM Students) x"),
+        FakeDatabaseManager().get_table_columns,
+    )
+    assert parsed["columns_by_table"] == {"Students": ["FullName", "UserID"]}
+
+
+def test_student_may_list_own_teachers(permission_manager):
+    query = (
+        "SELECT Teachers.FullName FROM Teachers "
+        "JOIN Classes ON Teachers.TeacherID = Classes.TeacherID "
+        "JOIN Enrollments ON Classes.ClassID = Enrollments.ClassID "
+        "WHERE Enrollments.StudentID = 5;"
+    )
+    assert permission_manager.check_permissions(query, "student", FakeDatabaseManager())
+
+
+def test_student_may_select_own_grades(permission_manager):
+    query = (
+        "SELECT FullName, Grade FROM Students "
+        "JOIN Enrollments ON Students.StudentID = Enrollments.StudentID "
+        "WHERE Students.StudentID = 5;"
+    )
+    assert permission_manager.check_permissions(query, "student", FakeDatabaseManager())
+
+
+def test_student_may_not_select_teacher_email(permission_manager):
+    with pytest.raises(ValueError):
+        permission_manager.check_permissions(
+            "SELECT Email FROM Teachers;", "student", FakeDatabaseManager()
+        )
+
+
+def test_users_table_is_rejected(permission_manager):
+    with pytest.raises(ValueError):
+        permission_manager.check_permissions(
+            "SELECT * FROM Users;", "student", FakeDatabaseManager()
+        )
+
+
+def test_multiple_statements_are_rejected(permission_manager):
+    with pytest.raises(ValueError):
+        permission_manager.check_permissions(
+            "SELECT FullName FROM Students; DELETE FROM Students;", "student", FakeDatabaseManager()
+        )
+
+
+def test_users_in_string_literal_is_allowed(permission_manager):
+    query = "SELECT FullName FROM Students WHERE FullName = 'users';"
+    assert permission_manager.check_permissions(query, "student", FakeDatabaseManager())
+
+
+def test_grant_cache_distinguishes_comment_line_breaks(permission_manager):
+    commented = "SELECT FullName FROM Students -- UNION SELECT Email FROM Teachers;"
+    assert permission_manager.check_permissions(commented, "student", FakeDatabaseManager())
+
+    with pytest.raises(ValueError):
+        permission_manager.check_permissions(
+            "SELECT FullName FROM Students --\nUNION SELECT Email FROM Teachers;", "student", FakeDatabaseManager()
+        )
+    with pytest.raises(ValueError):
+        permission_manager.check_permissions(
+            "SELECT FullName FROM Students --\n; DELETE FROM Students;", "student", FakeDatabaseManager()
+        )
+
+
+def test_unparseable_query_is_rejected_without_llm(permission_manager):
+    with pytest.raises(ValueError):
+        permission_manager.check_permissions(
+            "SELECT Email FROM Teachers LIMIT 1 INTO @x;", "student", FakeDatabaseManager()
+        )
+
+
+def test_quiet_check_suppresses_sqlglot_warnings(permission_manager, caplog, capsys):
+    query = "CREATE TABLE t (a INT) ENGINE=InnoDB PARTITION BY HASH(a);"
+    with caplog.at_level(logging.WARNING, logger="sqlglot"):
+        with pytest.raises(ValueError):
+            permission_manager.check_permissions(query, "student", FakeDatabaseManager(), verbose=False)
+    assert not [r for r in caplog.records if r.name.startswith("sqlglot")]
+    assert capsys.readouterr().out == ""